@@ -4,13 +4,312 @@
 """Measurements for Yolo.
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from .tools import decode
-from .tools import cal_iou
+from numba import njit
+from .tools import batched_decode
 from .tools import nms, soft_nms
 
+epsilon = 1e-07
+
+# np.trapz was renamed to np.trapezoid in NumPy 2.0.
+try:
+    _trapz = np.trapezoid
+except AttributeError:
+    _trapz = np.trapz
+
+
+_prepare_cache = None
+
+
+def _to_np(tensor):
+    """Convert a tensor to ndarray in one bulk copy."""
+    if hasattr(tensor, "numpy"):
+        return tensor.numpy()
+    return np.asarray(tensor)
+
+
+def _prepare_one_image(xywhcp_true, xywhcp_pred,
+                       class_num=1,
+                       conf_threshold=0.5,
+                       nms_mode=0,
+                       nms_threshold=0.5,
+                       nms_sigma=0.5,
+                       pre_nms_top_k=1000):
+    """Run NMS on one decoded image and split out the classes.
+
+    Return:
+        A tuple of 4 ndarrays:
+        (xywhc_true, class_true, xywhc_pred, class_pred).
+    """
+    if nms_mode > 0 and len(xywhcp_pred) > 0:
+        # NMS is quadratic in the box count, cap the input
+        # to the top-k confidences first.
+        if (pre_nms_top_k is not None
+            and len(xywhcp_pred) > pre_nms_top_k):
+            top_index = np.argpartition(
+                -xywhcp_pred[:, 4], pre_nms_top_k)[:pre_nms_top_k]
+            xywhcp_pred = xywhcp_pred[top_index]
+        if nms_mode == 1:
+            xywhcp_pred = nms(xywhcp_pred, nms_threshold)
+        elif nms_mode == 2:
+            xywhcp_pred = soft_nms(
+                xywhcp_pred, nms_threshold,
+                conf_threshold, nms_sigma)
+
+    xywhc_true = xywhcp_true[..., :5]
+    xywhc_pred = xywhcp_pred[..., :5]
+    p_true = xywhcp_true[..., 5:]
+    p_pred = xywhcp_pred[..., 5:]
+
+    if len(p_true) > 0:
+        class_true = p_true.argmax(axis=-1)
+    else:
+        class_true = np.zeros((0,), dtype="int")
+    if len(p_pred) > 0:
+        class_pred = p_pred.argmax(axis=-1)
+    else:
+        class_pred = np.zeros((0,), dtype="int")
+    return xywhc_true, class_true, xywhc_pred, class_pred
+
+
+def _prepare(y_trues, y_preds,
+             class_num=1,
+             conf_threshold=0.5,
+             nms_mode=0,
+             nms_threshold=0.5,
+             nms_sigma=0.5,
+             pre_nms_top_k=1000,
+             version=3,
+             cache=True):
+    """Decode the whole batch, then run NMS per image with a process pool.
+
+    The result is memoized on the input objects and parameters,
+    so computing `create_score_mat` and `PR_func` on the same
+    arrays with the same settings only decodes once. The memo
+    matches inputs by object identity and cannot see in-place
+    mutations; callers that rewrite the same arrays between
+    calls should pass `cache=False`.
+
+    Return:
+        A list of per-image tuples from `_prepare_one_image`.
+    """
+    global _prepare_cache
+    inputs = (y_trues, *y_preds)
+    params = (class_num, conf_threshold,
+              nms_mode, nms_threshold, nms_sigma,
+              pre_nms_top_k, version)
+    if cache and _prepare_cache is not None:
+        cached_inputs, cached_params, cached_prepared = _prepare_cache
+        if (cached_params == params
+                and len(cached_inputs) == len(inputs)
+                and all(cached_in is given_in
+                        for cached_in, given_in
+                        in zip(cached_inputs, inputs))):
+            return cached_prepared
+
+    y_trues = _to_np(y_trues)
+    y_preds = tuple(_to_np(y_pred) for y_pred in y_preds)
+
+    xywhcp_trues = batched_decode(y_trues,
+                                  class_num=class_num,
+                                  version=version)
+    xywhcp_preds = batched_decode(*y_preds,
+                                  class_num=class_num,
+                                  threshold=conf_threshold,
+                                  version=version)
+
+    prepare_func = partial(_prepare_one_image,
+                           class_num=class_num,
+                           conf_threshold=conf_threshold,
+                           nms_mode=nms_mode,
+                           nms_threshold=nms_threshold,
+                           nms_sigma=nms_sigma,
+                           pre_nms_top_k=pre_nms_top_k)
+
+    max_workers = max((os.cpu_count() or 2) - 1, 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        prepared = list(executor.map(prepare_func,
+                                     xywhcp_trues,
+                                     xywhcp_preds,
+                                     chunksize=8))
+    if cache:
+        # Keep the original inputs referenced so the identity
+        # checks above stay valid across garbage collection.
+        _prepare_cache = (inputs, params, prepared)
+    return prepared
+
+
+@njit(cache=True)
+def _cal_iou_matrix(xywhc_true, xywhc_pred, out):
+    """Fill `out` with the (T, P) IoU matrix of two box sets.
+
+    Same math as `tools.cal_iou` on broadcast (T, 1, 5) and
+    (1, P, 5) inputs, but written directly into a preallocated
+    matrix without the broadcast temporaries.
+    """
+    num_true = xywhc_true.shape[0]
+    num_pred = xywhc_pred.shape[0]
+    for true_i in range(num_true):
+        x_true = xywhc_true[true_i, 0]
+        y_true = xywhc_true[true_i, 1]
+        w_true = xywhc_true[true_i, 2]
+        h_true = xywhc_true[true_i, 3]
+        area_true = w_true*h_true
+
+        for pred_i in range(num_pred):
+            x_pred = xywhc_pred[pred_i, 0]
+            y_pred = xywhc_pred[pred_i, 1]
+            w_pred = xywhc_pred[pred_i, 2]
+            h_pred = xywhc_pred[pred_i, 3]
+
+            inter_w = (min(x_true + w_true/2, x_pred + w_pred/2)
+                       - max(x_true - w_true/2, x_pred - w_pred/2))
+            inter_h = (min(y_true + h_true/2, y_pred + h_pred/2)
+                       - max(y_true - h_true/2, y_pred - h_pred/2))
+            inter_area = max(inter_w, 0.)*max(inter_h, 0.)
+
+            union_area = area_true + w_pred*h_pred - inter_area
+            out[true_i, pred_i] = inter_area/(union_area + epsilon)
+
+
+@njit(cache=True)
+def _per_class_tp(xywhc_true, class_true,
+                  xywhc_pred, class_pred,
+                  class_num, iou_threshold):
+    """Count TP/TPP per class over same-class IoU blocks.
+
+    Boxes are bucketed by class first, so only the dense
+    same-class sub-blocks of the IoU matrix are computed,
+    skipping the cross-class pairs entirely.
+
+    Return:
+        A tuple of 2 ndarrays: (num_TPP, num_TP).
+    """
+    order_true = np.argsort(class_true)
+    order_pred = np.argsort(class_pred)
+
+    bounds_true = np.zeros(class_num + 1, np.int64)
+    bounds_pred = np.zeros(class_num + 1, np.int64)
+    for i in range(class_true.shape[0]):
+        bounds_true[class_true[i] + 1] += 1
+    for i in range(class_pred.shape[0]):
+        bounds_pred[class_pred[i] + 1] += 1
+    for class_i in range(class_num):
+        bounds_true[class_i + 1] += bounds_true[class_i]
+        bounds_pred[class_i + 1] += bounds_pred[class_i]
+
+    num_TPP = np.zeros(class_num, np.int64)
+    num_TP = np.zeros(class_num, np.int64)
+
+    for class_i in range(class_num):
+        t_start = bounds_true[class_i]
+        t_end = bounds_true[class_i + 1]
+        p_start = bounds_pred[class_i]
+        p_end = bounds_pred[class_i + 1]
+        if t_start == t_end or p_start == p_end:
+            continue
+
+        best_pred = np.zeros(p_end - p_start)
+        for t_i in range(t_start, t_end):
+            true_i = order_true[t_i]
+            x_true = xywhc_true[true_i, 0]
+            y_true = xywhc_true[true_i, 1]
+            w_true = xywhc_true[true_i, 2]
+            h_true = xywhc_true[true_i, 3]
+            area_true = w_true*h_true
+
+            best_true = 0.
+            for p_i in range(p_start, p_end):
+                pred_i = order_pred[p_i]
+                x_pred = xywhc_pred[pred_i, 0]
+                y_pred = xywhc_pred[pred_i, 1]
+                w_pred = xywhc_pred[pred_i, 2]
+                h_pred = xywhc_pred[pred_i, 3]
+
+                inter_w = (min(x_true + w_true/2, x_pred + w_pred/2)
+                           - max(x_true - w_true/2, x_pred - w_pred/2))
+                inter_h = (min(y_true + h_true/2, y_pred + h_pred/2)
+                           - max(y_true - h_true/2, y_pred - h_pred/2))
+                inter_area = max(inter_w, 0.)*max(inter_h, 0.)
+
+                union_area = area_true + w_pred*h_pred - inter_area
+                iou_score = inter_area/(union_area + epsilon)
+
+                if iou_score > best_true:
+                    best_true = iou_score
+                if iou_score > best_pred[p_i - p_start]:
+                    best_pred[p_i - p_start] = iou_score
+            if best_true >= iou_threshold:
+                num_TP[class_i] += 1
+        for p_i in range(p_end - p_start):
+            if best_pred[p_i] >= iou_threshold:
+                num_TPP[class_i] += 1
+    return num_TPP, num_TP
+
+
+def _eval_one_image(prepared,
+                    class_num=1,
+                    iou_threshold=0.5,
+                    precision_mode=1):
+    """Evaluate one prepared image for `create_score_mat`.
+
+    Return:
+        A tuple of 3 ndarrays:
+        (denom_delta, TP_delta, det_delta).
+    """
+    xywhc_true, class_true, xywhc_pred, class_pred = prepared
+
+    denom_delta = np.zeros((class_num, 2))
+    TP_delta = np.zeros((class_num, 2))
+    det_delta = np.zeros((class_num,), dtype="int")
+
+    num_PP = np.bincount(class_pred, minlength=class_num)
+    num_P = np.bincount(class_true, minlength=class_num)
+    denom_delta[:, 0] += num_PP
+    denom_delta[:, 1] += num_P
+    det_delta += num_PP
+
+    if len(class_true) > 0 and len(class_pred) > 0:
+        if class_num > 4:
+            # Sparse class mask, only the same-class IoU
+            # sub-blocks are worth computing.
+            num_TPP, num_TP = _per_class_tp(
+                np.ascontiguousarray(xywhc_true),
+                class_true.astype("int64"),
+                np.ascontiguousarray(xywhc_pred),
+                class_pred.astype("int64"),
+                class_num, iou_threshold)
+        else:
+            iou_scores = np.empty((len(class_true), len(class_pred)))
+            _cal_iou_matrix(np.ascontiguousarray(xywhc_true),
+                            np.ascontiguousarray(xywhc_pred),
+                            iou_scores)
+            same_class = class_true[:, None]==class_pred[None, :]
+            iou_scores = np.where(same_class, iou_scores, 0.)
+
+            best_ious_true = np.max(iou_scores, axis=1)
+            best_ious_pred = np.max(iou_scores, axis=0)
+
+            num_TPP = np.bincount(
+                class_pred[best_ious_pred >= iou_threshold],
+                minlength=class_num)
+            num_TP = np.bincount(
+                class_true[best_ious_true >= iou_threshold],
+                minlength=class_num)
+
+        if precision_mode == 1:
+            denom_delta[:, 0] -= num_TPP - num_TP
+            num_TPP = num_TP
+        TP_delta[:, 0] += num_TPP
+        TP_delta[:, 1] += num_TP
+    return denom_delta, TP_delta, det_delta
+
 
 def create_score_mat(y_trues, *y_preds,
                      class_names=[],
@@ -18,9 +317,11 @@ def create_score_mat(y_trues, *y_preds,
                      nms_mode=0,
                      nms_threshold=0.5,
                      nms_sigma=0.5,
+                     pre_nms_top_k=1000,
                      iou_threshold=0.5,
                      precision_mode=1,
-                     version=3):
+                     version=3,
+                     cache=True):
     """Create score matrix table
     containing precision, recall, F1-score, gts and dets.
 
@@ -44,6 +345,9 @@ def create_score_mat(y_trues, *y_preds,
             threshold for eliminating duplicate boxes.
         nms_sigma: A float,
             sigma for Soft-NMS.
+        pre_nms_top_k: An integer or None,
+            limit the number of boxes fed into NMS
+            to the top-k confidences.
         iou_threshold: A float,
             threshold for true positive determination.
         precision_mode: An integer,
@@ -53,7 +357,12 @@ def create_score_mat(y_trues, *y_preds,
              TP : true positive;
              PP : predictive positive)
         version: An integer,
-            specifying the decode method, yolov1、v2 or v3.  
+            specifying the decode method, yolov1、v2 or v3.
+        cache: A boolean,
+            reuse the decoded boxes of the previous call
+            when the same inputs and settings are given again.
+            Pass False if the input arrays are mutated
+            in place between calls.
 
     Return:
         A Pandas.Dataframe
@@ -67,80 +376,158 @@ def create_score_mat(y_trues, *y_preds,
     TP_array = np.zeros((class_num, 2))
     det_counts = np.zeros((class_num,), dtype="int")
 
-    for i in range(len(y_trues)):
-        y_true = y_trues[i]
-        y_pred = [y_preds[j][i] for j in range(len(y_preds))]
-        
-        xywhcp_true = decode(y_true,
-                             class_num=class_num,
-                             version=version)
-        xywhcp_pred = decode(*y_pred,
+    prepared_list = _prepare(y_trues, y_preds,
                              class_num=class_num,
-                             threshold=conf_threshold,
-                             version=version)
-        if nms_mode > 0 and len(xywhcp_pred) > 0:
-            if nms_mode == 1:
-                xywhcp_pred = nms(xywhcp_pred, nms_threshold)
-            elif nms_mode == 2:
-                xywhcp_pred = soft_nms(
-                    xywhcp_pred, nms_threshold,
-                    conf_threshold, nms_sigma)
-
-        xywhc_true = xywhcp_true[..., :5]
-        xywhc_pred = xywhcp_pred[..., :5]
-        p_true = xywhcp_true[..., 5:]
-        p_pred = xywhcp_pred[..., 5:]
-        
-        if len(p_true) > 0:
-            class_true = p_true.argmax(axis=-1)
-        else:
-            class_true = p_true
-        if len(p_pred) > 0:
-            class_pred = p_pred.argmax(axis=-1)
-        else:
-            class_pred = p_pred
+                             conf_threshold=conf_threshold,
+                             nms_mode=nms_mode,
+                             nms_threshold=nms_threshold,
+                             nms_sigma=nms_sigma,
+                             pre_nms_top_k=pre_nms_top_k,
+                             version=version,
+                             cache=cache)
+    for prepared in prepared_list:
+        denom_delta, TP_delta, det_delta = _eval_one_image(
+            prepared,
+            class_num=class_num,
+            iou_threshold=iou_threshold,
+            precision_mode=precision_mode)
+        denom_array += denom_delta
+        TP_array += TP_delta
+        det_counts += det_delta
+    score_mat = np.zeros_like(TP_array)
+    np.divide(TP_array, denom_array,
+              out=score_mat, where=denom_array > 0)
+
+    precision = score_mat[:, 0]
+    recall = score_mat[:, 1]
+    pr_sum = precision + recall
+    F1_score = np.zeros_like(pr_sum)
+    np.divide(2*precision*recall, pr_sum,
+              out=F1_score, where=pr_sum > 0)
+
+    score_table = pd.DataFrame({
+        "precision": precision,
+        "recall": recall,
+        "F1-score": F1_score,
+        "gts": denom_array[:, 1].astype("int"),
+        "dets": det_counts})
+    score_table.index = class_names
+
+    return score_table
+
+
+def _group_by_class(classes, class_num):
+    """Group box indices by class in one stable sort.
+
+    Return:
+        A tuple of 2 ndarrays (order, bounds):
+        `order` permutes the boxes into class order and
+        `order[bounds[c]:bounds[c + 1]]` are the boxes of class c,
+        in their original order.
+    """
+    order = np.argsort(classes, kind="stable")
+    bounds = np.searchsorted(classes[order],
+                             np.arange(class_num + 1))
+    return order, bounds
+
+
+def _collect_one_image(prepared,
+                       class_num=1,
+                       iou_threshold=0.5,
+                       max_per_img=100):
+    """Collect detections of one prepared image for `PR_func`.
+
+    Detections are kept as 3 parallel arrays
+    (conf, box_id, iou_mask) in their native dtypes.
+    Box ids are local to the image, the caller should offset
+    them with the accumulated gts of all classes.
+
+    Return:
+        A tuple of 2 lists:
+        (num_P of each class, detections of each class).
+    """
+    xywhc_true, class_true, xywhc_pred, class_pred = prepared
+
+    detection_list = [None for _ in range(class_num)]
+
+    num_P_list = np.bincount(class_true, minlength=class_num)
+
+    if len(class_true) > 0 and len(class_pred) > 0:
+        iou_scores = np.empty((len(class_true), len(class_pred)))
+        _cal_iou_matrix(np.ascontiguousarray(xywhc_true),
+                        np.ascontiguousarray(xywhc_pred),
+                        iou_scores)
+        same_class = class_true[:, None]==class_pred[None, :]
+        iou_scores = np.where(same_class, iou_scores, 0.)
+
+        best_ious_pred = np.max(iou_scores, axis=0)
+
+        iou_mask = (best_ious_pred >= iou_threshold)
+        box_id_pred = np.argmax(iou_scores, axis=0).astype("int32")
+        conf_pred = xywhc_pred[:, 4].astype("float32")
+
+        order, bounds = _group_by_class(class_pred, class_num)
+        conf_pred = conf_pred[order]
+        box_id_pred = box_id_pred[order]
+        iou_mask = iou_mask[order]
 
         for class_i in range(class_num):
-            xywhc_true_class = xywhc_true[class_true==class_i]
-            xywhc_pred_class = xywhc_pred[class_pred==class_i]
-
-            num_PP = len(xywhc_pred_class)
-            num_P = len(xywhc_true_class)
-            denom_array[class_i] += (num_PP, num_P)
-            det_counts[class_i] += num_PP
-
-            if len(xywhc_true_class) > 0 and len(xywhc_pred_class) > 0:
-                xywhc_true_class = np.reshape(
-                    xywhc_true_class, (-1, 1, 5))
-                xywhc_pred_class = np.reshape(
-                    xywhc_pred_class, (1, -1, 5))
-
-                iou_scores = cal_iou(xywhc_true_class, xywhc_pred_class)
-
-                best_ious_true = np.max(iou_scores, axis=1)
-                best_ious_pred = np.max(iou_scores, axis=0) 
-
-                num_TPP = sum(best_ious_pred >= iou_threshold)
-                num_TP = sum(best_ious_true >= iou_threshold)
-                
-                if precision_mode == 1:
-                    denom_array[class_i, 0] -= num_TPP - num_TP
-                    num_TPP = num_TP
-                TP_array[class_i] += (num_TPP, num_TP)
-    score_table = np.true_divide(TP_array, denom_array)
-    score_table = pd.DataFrame(score_table)
-    score_table.columns = ["precision", "recall"]
-
-    precision = score_table["precision"]
-    recall = score_table["recall"]
-    F1_score = (2*precision*recall)/(precision + recall)
-    score_table["F1-score"] = F1_score
-    score_table["gts"] = denom_array[:, 1].astype("int")
-    score_table["dets"] = det_counts
+            if num_P_list[class_i] == 0:
+                continue
+            start = bounds[class_i]
+            end = bounds[class_i + 1]
+            if start == end:
+                continue
+            conf_class = conf_pred[start:end]
+            box_id_class = box_id_pred[start:end]
+            iou_mask_class = iou_mask[start:end]
+
+            if (max_per_img is not None
+                and len(conf_class) > max_per_img):
+                top_index = np.argpartition(
+                    -conf_class, max_per_img)[:max_per_img]
+                conf_class = conf_class[top_index]
+                box_id_class = box_id_class[top_index]
+                iou_mask_class = iou_mask_class[top_index]
+
+            detection_list[class_i] = (
+                conf_class, box_id_class, iou_mask_class)
+    return num_P_list, detection_list
+
+
+def _pr_curve(box_id_sorted, iou_mask_sorted, num_gts):
+    """Accumulate a PR curve over confidence-sorted detections.
+
+    A detection is a true positive if its IoU mask is set
+    and it's the first detection hitting its gt box,
+    the curves are then cumulative sums over the sorted detections.
 
-    score_table.index = class_names
+    Return:
+        A tuple of 2 ndarrays: (precisions, recalls),
+        both of length D + 1.
+    """
+    num_dets = box_id_sorted.shape[0]
+    precisions = np.empty(num_dets + 1)
+    recalls = np.empty(num_dets + 1)
 
-    return score_table
+    tp_flag = np.zeros(num_dets, dtype="bool")
+    hit_ids = box_id_sorted[iou_mask_sorted]
+    _, first_index = np.unique(hit_ids, return_index=True)
+    tp_flag[np.flatnonzero(iou_mask_sorted)[first_index]] = True
+
+    cum_TP = np.cumsum(tp_flag)
+    cum_TPP = np.cumsum(iou_mask_sorted)
+    num_FP = np.arange(1, num_dets + 1) - cum_TPP
+
+    precisions[:num_dets] = cum_TP/(cum_TP + num_FP)
+    recalls[:num_dets] = cum_TP/num_gts
+
+    precisions[num_dets] = 0
+    if num_dets > 0:
+        recalls[num_dets] = recalls[num_dets - 1]
+    else:
+        recalls[num_dets] = 0
+    return precisions, recalls
 
 
 class PR_func(object):
@@ -166,13 +553,21 @@ class PR_func(object):
             threshold for eliminating duplicate boxes.
         nms_sigma: A float,
             sigma for Soft-NMS.
+        pre_nms_top_k: An integer or None,
+            limit the number of boxes fed into NMS
+            to the top-k confidences.
         iou_threshold: A float,
             threshold for true positive determination.
         max_per_img: An integer,
             limit the number of objects
             that an image can detect at most.
         version: An integer,
-            specifying the decode method, yolov1、v2 or v3.  
+            specifying the decode method, yolov1、v2 or v3.
+        cache: A boolean,
+            reuse the decoded boxes of the previous call
+            when the same inputs and settings are given again.
+            Pass False if the input arrays are mutated
+            in place between calls.
 
     Return:
         `PR_func` instance, call this instance
@@ -186,122 +581,81 @@ class PR_func(object):
                  nms_mode=1,
                  nms_threshold=0.5,
                  nms_sigma=0.5,
+                 pre_nms_top_k=1000,
                  iou_threshold=0.5,
                  max_per_img=100,
-                 version=3):
+                 version=3,
+                 cache=True):
         class_num = len(class_names)
         self.class_num = class_num
         self.class_names = class_names
 
         gts = [0 for _ in range(class_num)]
-        detections = [np.empty((0, 3), dtype="float32")
-            for _ in range(class_num)]
-
-        for i_img in range(len(y_trues)):
-            y_true = y_trues[i_img]
-            y_pred = [y_preds[j][i_img] for j in range(len(y_preds))]
-            
-            xywhcp_true = decode(y_true,
-                                 class_num=class_num,
-                                 version=version)
-            xywhcp_pred = decode(*y_pred,
-                                 class_num=class_num,
-                                 threshold=conf_threshold,
-                                 version=version)
-            if nms_mode > 0 and len(xywhcp_pred) > 0:
-                if nms_mode == 1:
-                    xywhcp_pred = nms(xywhcp_pred, nms_threshold)
-                elif nms_mode == 2:
-                    xywhcp_pred = soft_nms(
-                        xywhcp_pred, nms_threshold,
-                        conf_threshold, nms_sigma)
-
-            xywhc_true = xywhcp_true[..., :5]
-            xywhc_pred = xywhcp_pred[..., :5]
-            p_true = xywhcp_true[..., 5:]
-            p_pred = xywhcp_pred[..., 5:]
-            
-            if len(p_true) > 0:
-                class_true = p_true.argmax(axis=-1)
-            else:
-                class_true = p_true
-            if len(p_pred) > 0:
-                class_pred = p_pred.argmax(axis=-1)
-            else:
-                class_pred = p_pred
+        confs = [[] for _ in range(class_num)]
+        box_ids = [[] for _ in range(class_num)]
+        iou_masks = [[] for _ in range(class_num)]
 
+        prepared_list = _prepare(y_trues, y_preds,
+                                 class_num=class_num,
+                                 conf_threshold=conf_threshold,
+                                 nms_mode=nms_mode,
+                                 nms_threshold=nms_threshold,
+                                 nms_sigma=nms_sigma,
+                                 pre_nms_top_k=pre_nms_top_k,
+                                 version=version,
+                                 cache=cache)
+        total_gts = 0
+        for prepared in prepared_list:
+            num_P_list, detection_list = _collect_one_image(
+                prepared,
+                class_num=class_num,
+                iou_threshold=iou_threshold,
+                max_per_img=max_per_img)
             for class_i in range(class_num):
-                xywhc_true_class = xywhc_true[class_true==class_i]
-                xywhc_pred_class = xywhc_pred[class_pred==class_i]
-
-                num_gts = gts[class_i]
-                num_P = len(xywhc_true_class)
-                gts[class_i] = num_gts + num_P
-
-                if num_P > 0 and len(xywhc_pred_class) > 0:
-                    xywhc_true_class = np.reshape(
-                        xywhc_true_class, (-1, 1, 5))
-                    xywhc_pred_class = np.reshape(
-                        xywhc_pred_class, (1, -1, 5))
-
-                    iou_scores = cal_iou(xywhc_true_class, xywhc_pred_class)
-                    best_ious_pred = np.max(iou_scores, axis=0)
-
-                    iou_mask = (best_ious_pred >= iou_threshold)
-                    iou_mask = iou_mask.astype("float32")
-
-                    box_id_pred = np.argmax(iou_scores, axis=0) + num_gts
-
-                    conf_pred = xywhc_pred_class[0, :, 4]
-                    detection = np.stack(
-                        (conf_pred, box_id_pred, iou_mask), axis=1)
-                    
-                    if (max_per_img is not None 
-                        and len(detection) > max_per_img):    
-                        sort_index = np.argsort(detection[:, 0])[::-1]
-                        detection = detection[sort_index]
-                        detection = detection[-max_per_img:]
-
-                    detections[class_i] = np.vstack(
-                        (detections[class_i], detection))
-
-        precisions = [[] for _ in range(class_num)]
-        recalls = [[] for _ in range(class_num)]
+                detection = detection_list[class_i]
+                if detection is not None:
+                    conf_class, box_id_class, iou_mask_class = detection
+                    confs[class_i].append(conf_class)
+                    box_ids[class_i].append(box_id_class + total_gts)
+                    iou_masks[class_i].append(iou_mask_class)
+                gts[class_i] += num_P_list[class_i]
+            total_gts += int(num_P_list.sum())
+
+        precisions = [None for _ in range(class_num)]
+        recalls = [None for _ in range(class_num)]
 
         for class_i in range(class_num):
             num_gts = gts[class_i]
-            detection = detections[class_i]
-            sort_index = np.argsort(detection[:, 0])[::-1]
-            detection = detection[sort_index]
-            for det_i in range(len(detection)):
-                det = detection[:det_i + 1]
-
-                obj_mask = det[:, 2].astype("bool")
-                num_TP = len(set(det[:, 1][obj_mask]))
-                num_dets = len(det)
-                num_TPP = obj_mask.sum()
-                num_FP = num_dets - num_TPP
-
-                precisions[class_i].append(num_TP/(num_TP + num_FP))
-                recalls[class_i].append(num_TP/num_gts)
-            precisions[class_i].append(0)
-            recalls[class_i].append(num_TP/num_gts)
-        precisions = [np.array(pc) for pc in precisions]
-        recalls = [np.array(rc) for rc in recalls]
-        
+            if confs[class_i]:
+                conf = np.concatenate(confs[class_i])
+                box_id = np.concatenate(box_ids[class_i])
+                iou_mask = np.concatenate(iou_masks[class_i])
+            else:
+                conf = np.empty((0,), dtype="float32")
+                box_id = np.empty((0,), dtype="int32")
+                iou_mask = np.empty((0,), dtype="bool")
+            sort_index = np.argsort(-conf)
+
+            precisions[class_i], recalls[class_i] = _pr_curve(
+                box_id[sort_index], iou_mask[sort_index], num_gts)
+
         self.precisions = precisions
         self.recalls = recalls
-        
+        # Interpolated precision envelope(monotone non-increasing),
+        # aligned to the sorted recalls for binary-search queries.
+        self._env_precisions = [
+            np.maximum.accumulate(pc[::-1])[::-1]
+            for pc in precisions]
+
     def __call__(self, recall, class_idx=0):
         if class_idx >= self.class_num:
             raise IndexError("Class index out of range")
-        precisions = self.precisions[class_idx]
         recalls = self.recalls[class_idx]
-        pc_idx = (recalls > recall).sum()
-        if pc_idx == 0:
+        pc_idx = np.searchsorted(recalls, recall, side="right")
+        if pc_idx >= len(recalls):
             precision = 0
         else:
-            precision = precisions[-pc_idx:].max()
+            precision = self._env_precisions[class_idx][pc_idx]
         return precision
 
     def plot_pr_curve(self, class_idx=0,
@@ -318,17 +672,12 @@ class PR_func(object):
         """
         if class_idx >= self.class_num:
             raise IndexError("Class index out of range")
-        precisions = self.precisions[class_idx].copy()
+        if smooth:
+            precisions = self._env_precisions[class_idx]
+        else:
+            precisions = self.precisions[class_idx]
         recalls = self.recalls[class_idx]
 
-        if smooth:
-            max_pc = 0
-            for i in range(len(precisions)-1, -1, -1):
-                if precisions[i] > max_pc:
-                    max_pc = precisions[i]
-                else:
-                    precisions[i] = max_pc
-        
         fig = plt.figure(figsize=figsize)
         plt.plot(recalls, precisions)
         plt.title("PR curve")
@@ -355,27 +704,17 @@ class PR_func(object):
         Return:
             A Pandas.Dataframe
         """
-        aps = [0 for _ in range(self.class_num)]
-        
+        aps = np.zeros(self.class_num + 1, dtype="float64")
+
         if mode == "area" or mode == "smootharea":
             for class_i in range(self.class_num):
                 if mode == "smootharea":
-                    precisions = self.precisions[class_i].copy()
-                    max_pc = 0
-                    for i in range(len(precisions)-1, -1, -1):
-                        if precisions[i] > max_pc:
-                            max_pc = precisions[i]
-                        else:
-                            precisions[i] = max_pc
+                    precisions = self._env_precisions[class_i]
                 else:
                     precisions = self.precisions[class_i]
                 recalls = self.recalls[class_i]
 
-                for pr_i in range(0, len(precisions)-1):
-                    delta = recalls[pr_i + 1] - recalls[pr_i]
-                    value = ((precisions[pr_i + 1] - precisions[pr_i])/2
-                             + precisions[pr_i])
-                    aps[class_i] += delta*value
+                aps[class_i] = _trapz(precisions, recalls)
         else:
             if mode == "voc2012":
                 recall_list = [0, 0.14, 0.29, 0.43, 0.57, 0.71, 1]
@@ -383,10 +722,10 @@ class PR_func(object):
                 recall_list = [i/10 for i in range(0, 11)]
 
             for class_i in range(self.class_num):
-                for rc in recall_list:
-                    aps[class_i] += self(rc, class_i)
-            aps = [ap/len(recall_list) for ap in aps]
-        aps.append(sum(aps)/len(aps))
+                aps[class_i] = sum(
+                    self(rc, class_i) for rc in recall_list)
+            aps[:-1] /= len(recall_list)
+        aps[-1] = aps[:-1].mean()
 
         ap_table = pd.DataFrame(aps)
         ap_table.columns = ["ap"]
@@ -630,6 +630,75 @@ def decode(*label_datas,
     output = np.array(output)
     return output
 
+
+def batched_decode(*label_datas,
+                   class_num=1,
+                   threshold=0.5,
+                   version=1):
+    """Decode a batch of predictions from yolo model.
+
+    Same as `decode`, but the label datas carry a leading
+    batch dimension and the whole batch is decoded with
+    vectorized numpy instead of a per-box Python loop.
+
+    Args:
+        *label_datas: Ndarrays,
+            shape: (batch, grid_heights, grid_widths, info).
+            Multiple label data can be given at once.
+        class_num:  An integer,
+            number of classes.
+        threshold: A float,
+            threshold for quantizing output.
+        version: An integer,
+            specifying the decode method, yolov1、v2 or v3.
+
+    Return:
+        A list of ndarrays of shape (num_boxes, 5 + class_num),
+        one per image.
+    """
+    batch_size = len(label_datas[0])
+    output = [[] for _ in range(batch_size)]
+
+    for label_data in label_datas:
+        grid_shape = label_data.shape[1:3]
+        if version == 1:
+            bbox_num = (label_data.shape[-1] - class_num)//5
+            xywhc = np.reshape(label_data[..., :-class_num],
+                               (-1, *grid_shape, bbox_num, 5))
+            prob = label_data[..., -class_num:]
+        elif version == 2 or version == 3:
+            bbox_num = label_data.shape[-1]//(5 + class_num)
+            label_data = np.reshape(label_data,
+                                    (-1, *grid_shape,
+                                     bbox_num, 5 + class_num))
+            xywhc = label_data[..., :-class_num]
+            prob = label_data[..., -class_num:]
+        else:
+            raise ValueError("Invalid version: %s" % version)
+
+        n_i, y_i, x_i, box_i = np.where(xywhc[..., 4] >= threshold)
+
+        xywhc_hit = xywhc[n_i, y_i, x_i, box_i]
+        x = (x_i + xywhc_hit[:, 0])/grid_shape[1]
+        y = (y_i + xywhc_hit[:, 1])/grid_shape[0]
+
+        if version == 1:
+            prob_hit = prob[n_i, y_i, x_i]
+        else:
+            prob_hit = prob[n_i, y_i, x_i, box_i]
+
+        xywhcp = np.concatenate(
+            (x[:, None], y[:, None],
+             xywhc_hit[:, 2:5], prob_hit), axis=1)
+
+        # `n_i` is non-decreasing, slice out each image's rows.
+        bounds = np.searchsorted(n_i, np.arange(batch_size + 1))
+        for i in range(batch_size):
+            output[i].append(xywhcp[bounds[i]:bounds[i + 1]])
+    output = [np.concatenate(xywhcps, axis=0) for xywhcps in output]
+    return output
+
+
 def vis_img(img,
             *label_datas,
             class_names=[],
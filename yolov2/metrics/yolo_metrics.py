@@ -59,22 +59,22 @@ def wrap_class_acc(grid_shape, bbox_num, class_num):
             y_pred,
             (-1, *grid_shape, bbox_num, 5 + class_num)) # N*S*S*B*5+C
         
-        pred_obj_mask = tf.cast(y_pred[..., 4] >= 0.5,
-                                dtype=y_true.dtype) # N*S*S*B
-
-        has_obj_mask = y_true[..., 4] # N*S*S*1
-        has_obj_mask = has_obj_mask*pred_obj_mask # N*S*S*B
+        pred_obj_mask = y_pred[..., 4] >= 0.5 # N*S*S*B
+        has_obj_mask = (y_true[..., 4] >= 0.5) & pred_obj_mask # N*S*S*B
 
         pi_true = tf.argmax(y_true[..., -class_num:], # N*S*S*1*C
-                            axis=-1) # N*S*S*1
+                            axis=-1,
+                            output_type=tf.int32) # N*S*S*1
         pi_pred = tf.argmax(y_pred[..., -class_num:], # N*S*S*B*C
-                            axis=-1) # N*S*S*B
-        
-        equal_mask = tf.cast(pi_true == pi_pred,
-                             dtype=y_true.dtype) # N*S*S*B
-        equal_mask = equal_mask*has_obj_mask # N*S*S*B
+                            axis=-1,
+                            output_type=tf.int32) # N*S*S*B
 
-        total = tf.reduce_sum(pred_obj_mask)
+        equal_mask = (pi_true == pi_pred) & has_obj_mask # N*S*S*B
+
+        num_equal = tf.cast(tf.math.count_nonzero(equal_mask),
+                            y_true.dtype)
+        total = tf.cast(tf.math.count_nonzero(pred_obj_mask),
+                        y_true.dtype)
 
-        return tf.reduce_sum(equal_mask)/(total + epsilon)
+        return num_equal/(total + epsilon)
     return class_acc
\ No newline at end of file
@@ -1 +1,2 @@
-from .yolo_metrics import wrap_obj_acc, wrap_iou_acc, wrap_class_acc
\ No newline at end of file
+from .yolo_metrics import wrap_obj_acc, wrap_iou_acc, wrap_class_acc
+from .yolo_metrics import YoloMetrics
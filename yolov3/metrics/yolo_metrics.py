@@ -5,13 +5,13 @@ from yolov3.losses import cal_iou
 epsilon = 1e-07
 
 def wrap_obj_acc(grid_shape, bbox_num, class_num):
+    shape_true = (-1, *grid_shape, 1, 5 + class_num)
+    shape_pred = (-1, *grid_shape, bbox_num, 5 + class_num)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def obj_acc(y_true, y_pred):
-        y_true = tf.reshape(
-            y_true,
-            (-1, *grid_shape, 1, 5 + class_num)) # N*S*S*1*5+C
-        y_pred = tf.reshape(
-            y_pred,
-            (-1, *grid_shape, bbox_num, 5 + class_num)) # N*S*S*B*5+C
+        y_true = tf.reshape(y_true, shape_true) # N*S*S*1*5+C
+        y_pred = tf.reshape(y_pred, shape_pred) # N*S*S*B*5+C
         
         c_true = y_true[..., 4] # N*S*S*1
         c_pred = tf.reduce_max(y_pred[..., 4], # N*S*S*B
@@ -25,13 +25,13 @@ def wrap_obj_acc(grid_shape, bbox_num, class_num):
 
 
 def wrap_iou_acc(grid_shape, bbox_num, class_num):
+    shape_true = (-1, *grid_shape, 1, 5 + class_num)
+    shape_pred = (-1, *grid_shape, bbox_num, 5 + class_num)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def iou_acc(y_true, y_pred):
-        y_true = tf.reshape(
-            y_true,
-            (-1, *grid_shape, 1, 5 + class_num)) # N*S*S*1*5+C
-        y_pred = tf.reshape(
-            y_pred,
-            (-1, *grid_shape, bbox_num, 5 + class_num)) # N*S*S*B*5+C
+        y_true = tf.reshape(y_true, shape_true) # N*S*S*1*5+C
+        y_pred = tf.reshape(y_pred, shape_pred) # N*S*S*B*5+C
 
         pred_obj_mask = tf.cast(y_pred[..., 4] >= 0.5,
                                 dtype=y_true.dtype) # N*S*S*B
@@ -51,30 +51,108 @@ def wrap_iou_acc(grid_shape, bbox_num, class_num):
 
 
 def wrap_class_acc(grid_shape, bbox_num, class_num):
+    shape_true = (-1, *grid_shape, 1, 5 + class_num)
+    shape_pred = (-1, *grid_shape, bbox_num, 5 + class_num)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def class_acc(y_true, y_pred):
-        y_true = tf.reshape(
-            y_true,
-            (-1, *grid_shape, 1, 5 + class_num)) # N*S*S*1*5+C
-        y_pred = tf.reshape(
-            y_pred,
-            (-1, *grid_shape, bbox_num, 5 + class_num)) # N*S*S*B*5+C
+        y_true = tf.reshape(y_true, shape_true) # N*S*S*1*5+C
+        y_pred = tf.reshape(y_pred, shape_pred) # N*S*S*B*5+C
         
-        pred_obj_mask = tf.cast(y_pred[..., 4] >= 0.5,
-                                dtype=y_true.dtype) # N*S*S*B
-
-        has_obj_mask = y_true[..., 4] # N*S*S*1
-        has_obj_mask = has_obj_mask*pred_obj_mask # N*S*S*B
+        pred_obj_mask = y_pred[..., 4] >= 0.5 # N*S*S*B
+        has_obj_mask = (y_true[..., 4] >= 0.5) & pred_obj_mask # N*S*S*B
 
         pi_true = tf.argmax(y_true[..., -class_num:], # N*S*S*1*C
-                            axis=-1) # N*S*S*1
+                            axis=-1,
+                            output_type=tf.int32) # N*S*S*1
         pi_pred = tf.argmax(y_pred[..., -class_num:], # N*S*S*B*C
-                            axis=-1) # N*S*S*B
-        
-        equal_mask = tf.cast(pi_true == pi_pred,
-                             dtype=y_true.dtype) # N*S*S*B
-        equal_mask = equal_mask*has_obj_mask # N*S*S*B
+                            axis=-1,
+                            output_type=tf.int32) # N*S*S*B
+
+        equal_mask = (pi_true == pi_pred) & has_obj_mask # N*S*S*B
+
+        num_equal = tf.cast(tf.math.count_nonzero(equal_mask),
+                            y_true.dtype)
+        total = tf.cast(tf.math.count_nonzero(pred_obj_mask),
+                        y_true.dtype)
+
+        return num_equal/(total + epsilon)
+    return class_acc
+
+
+class YoloMetrics(object):
+    """Shared-state metrics for Yolo.
+
+    When obj_acc, iou_acc and class_acc are tracked separately,
+    every batch reshapes y_true/y_pred and rebuilds the
+    predicted-object mask three times. This container does the
+    shared work once per `update_state` call and feeds the three
+    `tf.keras.metrics.Mean` accumulators from it.
+
+    Args:
+        grid_shape: A tuple or list of integers(heights, widths).
+        bbox_num: An integer, number of bounding boxes per grid.
+        class_num: An integer, number of classes.
+
+    Usage:
+        metrics = YoloMetrics(grid_shape, bbox_num, class_num)
+        metrics.update_state(y_true, y_pred)
+        metrics.result()
+    """
+    def __init__(self, grid_shape, bbox_num, class_num):
+        self.grid_shape = grid_shape
+        self.bbox_num = bbox_num
+        self.class_num = class_num
+        self._shape_true = (-1, *grid_shape, 1, 5 + class_num)
+        self._shape_pred = (-1, *grid_shape, bbox_num, 5 + class_num)
+        self.obj_acc = tf.keras.metrics.Mean(name="obj_acc")
+        self.iou_acc = tf.keras.metrics.Mean(name="iou_acc")
+        self.class_acc = tf.keras.metrics.Mean(name="class_acc")
+
+    def update_state(self, y_true, y_pred):
+        y_true = tf.reshape(y_true, self._shape_true) # N*S*S*1*5+C
+        y_pred = tf.reshape(y_pred, self._shape_pred) # N*S*S*B*5+C
 
-        total = tf.reduce_sum(pred_obj_mask)
+        c_true = y_true[..., 4] # N*S*S*1
+        c_pred = tf.reduce_max(y_pred[..., 4], # N*S*S*B
+                               axis=-1,
+                               keepdims=True) # N*S*S*1
+
+        pred_obj_mask = y_pred[..., 4] >= 0.5 # N*S*S*B
+        pred_obj = tf.cast(pred_obj_mask,
+                           dtype=y_true.dtype) # N*S*S*B
+        has_obj_mask = c_true*pred_obj # N*S*S*B
+        total = tf.reduce_sum(pred_obj)
 
-        return tf.reduce_sum(equal_mask)/(total + epsilon)
-    return class_acc
\ No newline at end of file
+        self.obj_acc.update_state(
+            binary_accuracy(c_true, c_pred))
+
+        iou_scores = cal_iou(y_true[..., :4],
+                             y_pred[..., :4],
+                             self.grid_shape) # N*S*S*B
+        iou_scores = iou_scores*has_obj_mask # N*S*S*B
+        self.iou_acc.update_state(
+            tf.reduce_sum(iou_scores)/(total + epsilon))
+
+        pi_true = tf.argmax(y_true[..., -self.class_num:], # N*S*S*1*C
+                            axis=-1,
+                            output_type=tf.int32) # N*S*S*1
+        pi_pred = tf.argmax(y_pred[..., -self.class_num:], # N*S*S*B*C
+                            axis=-1,
+                            output_type=tf.int32) # N*S*S*B
+        equal_mask = ((pi_true == pi_pred)
+                      & (c_true >= 0.5) & pred_obj_mask) # N*S*S*B
+        num_equal = tf.cast(tf.math.count_nonzero(equal_mask),
+                            y_true.dtype)
+        self.class_acc.update_state(
+            num_equal/(total + epsilon))
+
+    def result(self):
+        return {"obj_acc": self.obj_acc.result(),
+                "iou_acc": self.iou_acc.result(),
+                "class_acc": self.class_acc.result()}
+
+    def reset_state(self):
+        self.obj_acc.reset_state()
+        self.iou_acc.reset_state()
+        self.class_acc.reset_state()